@@ -17,28 +17,26 @@ class ContextManager(Protocol, Generic[T]):
         ...
 
 
+# default for next(), so the end of the iterator can be detected without catching StopIteration
+_EXHAUSTED = object()
+
+
 def context_manager(func: Callable[..., Iterator[T]]) -> type[ContextManager[T]]:
     class ContextManagerWrapper:
         def __init__(self, *args: Any, **kwargs: Any) -> None:
             self.iterator = func(*args, **kwargs)
 
         def __enter__(self) -> T:
-            try:
-                value = next(self.iterator)
-            except StopIteration:
+            value = next(self.iterator, _EXHAUSTED)
+            if value is _EXHAUSTED:
                 raise ValueError(
                     "Iterator must yield one object, but didn't yield anything"
                 )
-            return value
+            return value  # type: ignore[return-value]
 
         def __exit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
-            try:
-                next(
-                    self.iterator
-                )  # run the cleanup code by going through the rest of the function
-            except StopIteration:
-                pass  # expected that there is no next item
-            else:
+            # run the cleanup code by going through the rest of the function
+            if next(self.iterator, _EXHAUSTED) is not _EXHAUSTED:
                 raise ValueError(
                     "Iterator must yield only one object, yielded multiple"
                 )
@@ -61,16 +59,14 @@ def temporary_directory(name: str) -> Iterator[Path]:
         raise ValueError(
             f"Path {dirpath=} already exists, cannot create temporary directory"
         )
-    dirs_to_create = [path for path in reversed(dirpath.parents) if not path.exists()]
-    for dir_ in dirs_to_create:
-        dir_.mkdir()
-    dirpath.mkdir()
+    # the outermost directory that gets created, deleting it cleans up everything
+    existing_parent = next(path for path in dirpath.parents if path.exists())
+    top_dir = existing_parent / dirpath.relative_to(existing_parent).parts[0]
+    dirpath.mkdir(parents=True)
 
     yield dirpath
 
-    shutil.rmtree(dirpath)
-    for dir_ in reversed(dirs_to_create):
-        dir_.rmdir()
+    shutil.rmtree(top_dir)
 
 
 def main() -> None:
@@ -1,9 +1,12 @@
 """Defines a Future monad that can wrap values as futures and then transform them"""
 from __future__ import annotations
 
+import asyncio
+import sys
 import time
-from threading import Condition, Thread
-from typing import Callable, Generic, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+from typing import Any, Callable, Generator, Generic, TypeVar
 
 
 class NoResultYet:
@@ -11,39 +14,81 @@ class NoResultYet:
 
 NO_RESULT = NoResultYet()
 
+# threads are reused across futures, instead of starting a new thread for every future
+# (the default worker count is used, as most workers spend their time blocked on another future)
+_EXECUTOR = ThreadPoolExecutor()
+
 
 T = TypeVar("T")
 R = TypeVar("R")
 class Future(Generic[T]):
     def __init__(self, function: Callable[[], T]) -> None:
+        self._function = function
+        # set by transform, so a chain of futures can be computed in a loop instead of recursively
+        self._parent: Future[Any] | None = None
         self._result: T | NoResultYet = NO_RESULT
-        self._has_result = Condition()
-
-        def set_result_func() -> None:
-            result = function()
-            with self._has_result:
-                self._result = result
-                self._has_result.notify_all()
-
-        self._thread = Thread(target=set_result_func)
+        self._exception: BaseException | None = None
+        self._done = Event()
+        self._started = False
+        # acquired (and never released) by whichever thread computes the result
+        self._claimed = Lock()
+
+    def _compute(self) -> None:
+        """Compute the result, storing any exception so waiters see it instead of it being lost in the pool"""
+        try:
+            self._result = self._function()
+        except BaseException as exception:
+            self._exception = exception
+        finally:
+            self._done.set()
+
+    def _execute(self) -> None:
+        """Compute the result, unless another thread has already claimed the computation"""
+        if not self._claimed.acquire(blocking=False):
+            return
+        # also claim the unclaimed ancestors, then compute them oldest first
+        # so each stage only waits on a finished parent, and a long chain doesn't recurse
+        chain: list[Future[Any]] = [self]
+        while (parent := chain[-1]._parent) is not None and parent._claimed.acquire(
+            blocking=False
+        ):
+            parent._started = True  # no need to submit it, it is computed here
+            chain.append(parent)
+        for future in reversed(chain):
+            future._compute()
+
+    def _raise_exception(self) -> None:
+        if self._exception is not None:
+            raise self._exception
 
     def run(self) -> None:
         """Start the future"""
-        if not self._thread.is_alive():
-            self._thread.start()
+        # a racing second submit is harmless, as only one thread can claim the computation
+        if self._started:
+            return
+        self._started = True
+        _EXECUTOR.submit(self._execute)
 
     def result(self) -> T | NoResultYet:
-        """Check if there is a result"""
-        with self._has_result:
-            return self._result
+        """Check if there is a result, raises the exception if computing the result failed"""
+        self._raise_exception()
+        return self._result
         
     def await_result(self) -> T:
-        """Wait for the result of the future"""
-        self.run()
-        with self._has_result:
-            while isinstance((result := self.result()), NoResultYet):
-                self._has_result.wait()
-        return result
+        """Wait for the result of the future, raises the exception if computing the result failed"""
+        # compute the result in this thread if no worker has picked it up yet
+        # otherwise a worker waiting on a queued future could block the whole pool
+        # it is marked as started without being submitted, as the pool task would have nothing to do
+        self._started = True
+        self._execute()
+        self._done.wait()
+        self._raise_exception()
+        return self._result  # type: ignore[return-value]
+
+    def __await__(self) -> Generator[Any, None, T]:
+        """Wait for the result from a coroutine, without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return (yield from loop.run_in_executor(_EXECUTOR, self.await_result))
 
     @classmethod
     def from_value(self, value: T) -> Future[T]:
@@ -51,7 +96,9 @@ class Future(Generic[T]):
     
     def transform(self, function: Callable[[T], R]) -> Future[R]:
         """Create a new future that computes the result of `function` applied to the result of this future"""
-        return Future(lambda: function(self.await_result()))
+        future = Future(lambda: function(self.await_result()))
+        future._parent = self
+        return future
     
     def __or__(self, function: Callable[[T], R]) -> Future[R]:
         return self.transform(function)
@@ -71,6 +118,8 @@ def test_wrapping() -> None:
     input_value = Future.from_value(2)
     assert input_value.result() == NO_RESULT
     input_value.run()
+    # run only submits the future to the pool, so wait for a worker to compute it
+    assert input_value.await_result() == 2
     assert input_value.result() == 2
 
 
@@ -97,6 +146,51 @@ def test_await_result() -> None:
     assert result == 16
 
 
+def test_long_chain() -> None:
+    future = Future.from_value(0)
+    for _ in range(100):
+        future = future | (lambda num: num + 1)
+    future.run()
+    assert future.await_result() == 100
+
+
+def test_chain_longer_than_recursion_limit() -> None:
+    length = sys.getrecursionlimit() * 2
+    future = Future.from_value(0)
+    for _ in range(length):
+        future = future | (lambda num: num + 1)
+    assert future.await_result() == length
+
+
+def test_failing_stage() -> None:
+    def fail(_: int) -> int:
+        raise ValueError("stage failed")
+
+    future = Future.from_value(1) | fail | add_one
+    future.run()
+    try:
+        future.await_result()
+    except ValueError as exception:
+        assert str(exception) == "stage failed"
+    else:
+        assert False, "the exception should be raised by await_result"
+    try:
+        future.result()
+    except ValueError:
+        pass
+    else:
+        assert False, "the exception should be raised by result"
+
+
+def test_await_in_coroutine() -> None:
+    async def await_both() -> list[int]:
+        return list(await asyncio.gather(Future.from_value(2) | square, Future.from_value(3) | square))
+
+    start_time = time.monotonic()
+    assert asyncio.run(await_both()) == [4, 9]
+    assert time.monotonic() - start_time < 0.9
+
+
 def test_multiple_dependencies() -> None:
     input_value = Future.from_value(2)
     ancestor = input_value | square
@@ -124,5 +218,5 @@ def test_idempotent_run() -> None:
     future = Future.from_value(2) | counter
     future.run()
     future.run()
-    time.sleep(0.001)
-    assert future.result() == 1
+    assert future.await_result() == 1
+    assert result == 1
@@ -4,7 +4,7 @@ It ensures the queue stays below the max capacity, so that producers are not ove
 It also allows for tasks to be marked as done, so the queue can be joined and wait for all threads to complete
 """
 import threading
-from collections import deque
+from queue import SimpleQueue
 from random import randrange
 from typing import Generic, TypeVar
 
@@ -13,41 +13,35 @@ T = TypeVar("T")
 
 class MessageQueue(Generic[T]):
     def __init__(self, capacity: int = 64) -> None:
-        self._capacity = capacity
-        self._queue: deque[T] = deque()
+        self._queue: SimpleQueue[T] = SimpleQueue()
         self._unfinished_tasks = 0
 
+        # producers take a slot before putting an item, and consumers give it back after getting one
+        # so the queue never holds more than capacity items
+        self._slots = threading.Semaphore(capacity)
+
         self._lock = threading.Lock()
-        self._not_empty = threading.Condition(self._lock)
-        self._not_full = threading.Condition(self._lock)
         self._all_tasks_done = threading.Condition(self._lock)
 
     def put(self, item: T) -> None:
         """Put the item into the queue, block if the queue is full"""
-        with self._not_full:
-            # note: get could be called twice,
-            # notifying 1 thread to do two puts, then notifying another thread to also do a put
-            # resulting in 3 items being added to a queue that only had capacity for 2
-            # see https://stackoverflow.com/a/7909803
-            while len(self._queue) >= self._capacity:
-                self._not_full.wait()
-            self._queue.append(item)
+        self._slots.acquire()
+        with self._lock:
             self._unfinished_tasks += 1
-            self._not_empty.notify()
+        self._queue.put(item)
 
     def get(self) -> T:
         """Get an item from the queue, block until there is an item"""
-        with self._not_empty:
-            while not self._queue:
-                self._not_empty.wait()
-            result = self._queue.popleft()
-            self._not_full.notify()
-            return result
+        result = self._queue.get()
+        self._slots.release()
+        return result
 
     def task_done(self) -> None:
         with self._all_tasks_done:
             self._unfinished_tasks -= 1
-            self._all_tasks_done.notify()
+            # joiners only care about the last task, so don't wake them for the others
+            if self._unfinished_tasks == 0:
+                self._all_tasks_done.notify_all()
 
     def join(self) -> None:
         """Wait until all tasks are done"""
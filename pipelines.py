@@ -2,7 +2,7 @@
 from __future__ import annotations
 
 import collections
-from typing import Callable, Generic, Iterable, TypeVar, overload
+from typing import Any, Callable, Generic, Iterable, TypeVar, overload
 
 T = TypeVar("T")
 T1 = TypeVar("T1")
@@ -11,11 +11,27 @@ T3 = TypeVar("T3")
 
 
 class Pipeline(Generic[T1, T2]):
-    def __init__(self, f: Callable[[T1], T2]) -> None:
-        self.f = f
+    def __init__(self, f: Callable[[T1], T2], *fs: Callable[[Any], Any]) -> None:
+        # the stages are kept flat, instead of nesting a closure per stage
+        self._fs = (f, *fs)
+        self._composed: Callable[[T1], T2] | None = None
+
+    def _compose(self) -> Callable[[T1], T2]:
+        """Generate a single function that calls each stage in turn, without a loop or a closure frame per stage"""
+        names = [f"f{i}" for i in range(len(self._fs))]
+        lines = [f"    x = {name}(x)" for name in names]
+        source = "def composed(x):\n" + "\n".join(lines) + "\n    return x\n"
+        namespace: dict[str, Any] = dict(zip(names, self._fs))
+        exec(source, namespace)
+        return namespace["composed"]
+
+    def _get_composed(self) -> Callable[[T1], T2]:
+        if self._composed is None:
+            self._composed = self._compose()
+        return self._composed
 
     def __call__(self, arg: T1) -> T2:
-        return self.f(arg)
+        return self._get_composed()(arg)
 
     @overload
     def __ror__(self, other: Iterable[T1]) -> Iterable[T2]:  # type: ignore[misc]
@@ -27,12 +43,13 @@ class Pipeline(Generic[T1, T2]):
 
     def __ror__(self, other: Iterable[T1] | T1) -> Iterable[T2] | T2:
         if isinstance(other, collections.abc.Iterable) and not isinstance(other, str):
-            return map(self.f, other)
+            # map the generated function directly, rather than going through __call__ for each element
+            return map(self._get_composed(), other)
         else:
-            return self.f(other) # type: ignore[arg-type]
+            return self(other) # type: ignore[arg-type]
 
     def __or__(self, other: Callable[[T2], T3]) -> Pipeline[T1, T3]:
-        return Pipeline(lambda x: other(self.f(x)))
+        return Pipeline(*self._fs, other)
 
 
 class Filter(Generic[T]):
@@ -1,104 +1,185 @@
 from __future__ import annotations
 
 import logging
+import sys
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from itertools import cycle
 from random import randrange
-from typing import Iterator
+from typing import Iterator, Sequence
 
 from hypothesis import given
 from hypothesis import strategies as st
 
+log = logging.getLogger(name="threading_test")
+
+# number of messages moved per lock acquisition by the fixed producers and the consumers
+PRODUCER_BATCH_SIZE = 64
+CONSUMER_BATCH_SIZE = 64
+
+# random batch sizes for the producers to cycle through, instead of calling randrange for every batch
+RANDOM_BATCH_SIZES = tuple(randrange(1, 20) for _ in range(1024))
+
 
 class TerminationController:
+    __slots__ = ("_terminated",)
+
     def __init__(self, duration: float) -> None:
-        self.end_time = time.time() + duration
+        # a timer sets the event once, so checking for termination doesn't read the clock
+        self._terminated = threading.Event()
+        timer = threading.Timer(duration, self._terminated.set)
+        timer.daemon = True
+        timer.start()
 
     def should_terminate(self) -> bool:
-        return time.time() > self.end_time
+        return self._terminated.is_set()
 
 
 class MessageQueue:
-    def __init__(self, use_locks: bool) -> None:
-        self._capacity = 8
+    __slots__ = (
+        "_capacity",
+        "_max_capacity",
+        "_mask",
+        "_message_queue",
+        "_read_pos",
+        "_append_pos",
+        "_lock",
+        "_not_empty",
+        "_not_full",
+        "_use_locks",
+    )
+
+    def __init__(
+        self, use_locks: bool, capacity: int = 8, max_capacity: int = 1024
+    ) -> None:
+        for size in (capacity, max_capacity):
+            if size <= 0 or size & (size - 1) != 0:
+                raise ValueError(f"Queue capacities must be powers of two, got {size=}")
+        # a circular buffer, that only reallocates when it fills up and doubles in size
+        self._capacity = capacity
+        self._max_capacity = max_capacity
+        self._mask = capacity - 1
         self._message_queue: list[int | None] = [None] * self._capacity
+        # total number of items read and appended, the buffer index is the position masked by the capacity
         self._read_pos = 0
         self._append_pos = 0
 
-        self._read_lock = threading.Lock()
-        self._write_lock = threading.Lock()
+        # reads and writes both use the read and append positions, so they share one lock
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
         self._use_locks = use_locks
 
-    # NOTE: expand_capacity and shrink_capacity need to acquire both locks
-    # (i.e. expand_capacity needs to also acquire read lock, and shrink capacity the write lock)
-    # as reads and writes are both affected by changing self._read_pos and self._append_pos
-
-    @property
-    def _all_items(self) -> list[int | None]:
-        return self._message_queue[self._read_pos : self._append_pos]
-
-    def _shrink_capacity(self) -> None:
-        with self._write_lock:
-            self._capacity //= 2
-            new_message_queue: list[int | None] = [None] * self._capacity
-            new_message_queue[: len(self)] = self._all_items
-            self._message_queue = new_message_queue
-            self._read_pos, self._append_pos = 0, len(self)
-
     def _popleft(self) -> int:
-        """Pop item from the queue, if the queue is mostly empty then shrink it to save space"""
+        """Pop item from the queue"""
         if self._read_pos == self._append_pos:
             raise IndexError(
                 f"The queue is empty as {self._read_pos=} and {self._append_pos=} are the same"
             )
-        if self._capacity > 8 and len(self) <= self._capacity // 2:
-            self._shrink_capacity()
-        result = self._message_queue[self._read_pos]
+        result = self._message_queue[self._read_pos & self._mask]
         assert result is not None
         self._read_pos += 1
         return result
 
     def _expand_capacity(self) -> None:
-        """Double the queue capacity, and remove deleted items"""
-        with self._read_lock:
-            self._capacity *= 2
-            new_message_queue: list[int | None] = [None] * self._capacity
-            new_message_queue[: len(self)] = self._all_items
-            self._message_queue = new_message_queue
-            self._read_pos, self._append_pos = 0, len(self)
-
-    def _append(self, item: int) -> None:
-        """Add item, expand the capacity if the maximum capacity is reached"""
-        if self._append_pos == self._capacity:
+        """Double the queue capacity, unrolling the full buffer so the oldest item is first"""
+        start = self._read_pos & self._mask
+        items = self._message_queue[start:] + self._message_queue[:start]
+        self._capacity *= 2
+        self._mask = self._capacity - 1
+        self._message_queue = items + [None] * len(items)
+        self._read_pos, self._append_pos = 0, len(items)
+
+    def _append(self, item: int) -> bool:
+        """Add item, expanding the queue if it is full, or discard it and return False if at the maximum capacity"""
+        if self._append_pos - self._read_pos == self._capacity:
+            if self._capacity == self._max_capacity:
+                return False
             self._expand_capacity()
-        self._message_queue[self._append_pos] = item
+        self._message_queue[self._append_pos & self._mask] = item
         self._append_pos += 1
+        return True
 
     @contextmanager
-    def check_has_item(self) -> Iterator[bool]:
+    def check_has_item(self, timeout: float = 0.01) -> Iterator[bool]:
+        """Check if there is an item, when using locks wait up to `timeout` seconds for one to be added"""
         if not self._use_locks:
-            yield bool(self)
+            has_item = self._append_pos != self._read_pos
+            if not has_item:
+                # can't wait on the condition without the lock, so let the producers run instead of spinning
+                time.sleep(0)
+            yield has_item
             return
-        with self._read_lock:
-            yield bool(self)
+        with self._not_empty:
+            if self._append_pos == self._read_pos:
+                # block until a producer adds an item, instead of making the consumer spin
+                self._not_empty.wait(timeout)
+            read_pos = self._read_pos
+            try:
+                yield self._append_pos != self._read_pos
+            finally:
+                # wake a producer for each item the caller popped while holding the lock
+                # (next_item and next_items can't notify, as they are also called without the lock)
+                self._not_full.notify(self._read_pos - read_pos)
 
     def next_item(self) -> int:
         return self._popleft()
 
-    """
-    get_next_item is the ideal model, I separated the has_item and next item functions to cause a race condition
-    @contextmanager
-    def get_next_item(self) -> Iterator[int | None]:
-        with self._lock:
-            yield None if not self.message_queue else self.message_queue.popleft()
-    """
-
-    def add_item(self, item: int) -> None:
-        with self._write_lock:
-            self._append(item)
-
+    def next_items(self, max_items: int) -> list[int]:
+        """Pop up to `max_items` items, raises IndexError if the queue is empty"""
+        items = [self._popleft()]
+        while len(items) < max_items and self._read_pos != self._append_pos:
+            items.append(self._popleft())
+        return items
+
+    def pop_into(self, result: list[int], max_items: int, timeout: float = 0.01) -> int:
+        """
+        Pop up to `max_items` items into `result`, waiting up to `timeout` seconds for one to be added
+        Returns the number of items popped
+        This is the ideal model, checking for, popping and recording items under one lock acquisition
+        (recording them after releasing the lock would let another consumer record later items first)
+        check_has_item and next_item are separated to cause a race condition
+        """
+        with self._not_empty:
+            if self._append_pos == self._read_pos:
+                self._not_empty.wait(timeout)
+            if self._append_pos == self._read_pos:
+                return 0
+            items = self.next_items(max_items)
+            result.extend(items)
+            self._not_full.notify(len(items))
+            return len(items)
+
+    def add_item(self, item: int) -> bool:
+        """Add item, returns False if the queue was full and the item was discarded"""
+        with self._not_empty:
+            if not self._append(item):
+                return False
+            self._not_empty.notify()
+            return True
+
+    def add_items(self, items: Sequence[int], timeout: float = 0) -> int:
+        """
+        Add as many of the items as fit in the queue, returns the number of items added
+        If the queue is full, wait up to `timeout` seconds for a consumer to make space
+        """
+        with self._not_empty:
+            if (
+                self._append_pos - self._read_pos == self._capacity
+                and self._capacity == self._max_capacity
+            ):
+                # block until a consumer pops an item, instead of making the producer spin
+                self._not_full.wait(timeout)
+            num_added = 0
+            for item in items:
+                if not self._append(item):
+                    break
+                num_added += 1
+            self._not_empty.notify(num_added)
+            return num_added
+
+    # the hot paths compare the positions directly, rather than dispatching through __len__ and __bool__
     def __len__(self) -> int:
         return self._append_pos - self._read_pos
 
@@ -106,6 +187,18 @@ class MessageQueue:
         return len(self) > 0
 
 
+def add_items_until_accepted(
+    queue: MessageQueue,
+    termination_controller: TerminationController,
+    items: Sequence[int],
+) -> bool:
+    """Keep adding the items while the queue is full, returns False if terminated before they were all added"""
+    while items := items[queue.add_items(items, timeout=0.01) :]:
+        if termination_controller.should_terminate():
+            return False
+    return True
+
+
 def producer(
     queue: MessageQueue,
     termination_controller: TerminationController,
@@ -113,10 +206,17 @@ def producer(
     time_scale: float,
 ) -> None:
     """Produce some messages"""
-    messages = iter(range(start_range, 100_000))
+    message, end = start_range, 100_000
+    # start at a random point, so producers don't all use the same sequence of sizes
+    start = randrange(len(RANDOM_BATCH_SIZES))
+    batch_sizes = cycle(RANDOM_BATCH_SIZES[start:] + RANDOM_BATCH_SIZES[:start])
     while not termination_controller.should_terminate():
-        for _ in range(randrange(1, 20)):
-            queue.add_item(next(messages))
+        batch = range(message, min(message + next(batch_sizes), end))
+        if not batch:
+            return  # ran out of messages
+        message = batch.stop
+        if not add_items_until_accepted(queue, termination_controller, batch):
+            return
         time.sleep(time_scale)
 
 
@@ -127,18 +227,21 @@ def consumer(
     processing_time: float,
 ) -> None:
     """Consume messages immediately"""
+    # checked once, so disabled info logs cost nothing per message
+    log_info = log.isEnabledFor(logging.INFO)
     while not termination_controller.should_terminate():
         with queue.check_has_item() as has_item:
             if not has_item:
                 continue
 
-            log.info("%s verified queue has an item, now waiting", processing_time)
+            if log_info:
+                log.info("%s verified queue has an item, now waiting", processing_time)
             if processing_time != 0:
                 time.sleep(
                     processing_time
                 )  # processing, potentially another thread can interefere and cause a race condition
             try:
-                item = queue.next_item()
+                items = queue.next_items(CONSUMER_BATCH_SIZE)
             except Exception as exception:
                 log.error(
                     "%s found an empty queue, after another thread emptied it, which raised Exception=%s",
@@ -146,8 +249,19 @@ def consumer(
                     exception,
                 )
             else:
-                log.info("%s Processed: %s", processing_time, item)
-                result.append(item)
+                if log_info:
+                    log.info("%s Processed: %s", processing_time, items)
+                result.extend(items)
+
+
+def fast_consumer(
+    queue: MessageQueue,
+    termination_controller: TerminationController,
+    result: list[int],
+) -> None:
+    """Consume messages as fast as possible, without leaving room for a race condition"""
+    while not termination_controller.should_terminate():
+        queue.pop_into(result, CONSUMER_BATCH_SIZE)
 
 
 def run_experiment(
@@ -156,19 +270,28 @@ def run_experiment(
     message_queue = MessageQueue(use_locks=True)
     termination_controller = TerminationController(time_scale)
     result: list[int] = []
-    with ThreadPoolExecutor() as executor:
-        executor.submit(
-            producer, message_queue, termination_controller, start_val1, time_scale
-        )
-        executor.submit(
-            producer, message_queue, termination_controller, start_val2, time_scale
-        )
-        executor.submit(
-            consumer, message_queue, termination_controller, result, time_scale * 0.01
-        )
-        executor.submit(
-            consumer, message_queue, termination_controller, result, time_scale * 0.005
-        )
+    threads = [
+        threading.Thread(
+            target=producer,
+            args=(message_queue, termination_controller, start_val1, time_scale),
+        ),
+        threading.Thread(
+            target=producer,
+            args=(message_queue, termination_controller, start_val2, time_scale),
+        ),
+        threading.Thread(
+            target=consumer,
+            args=(message_queue, termination_controller, result, time_scale * 0.01),
+        ),
+        threading.Thread(
+            target=consumer,
+            args=(message_queue, termination_controller, result, time_scale * 0.005),
+        ),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
     return result
 
 
@@ -187,9 +310,15 @@ def test_race_conditions(start_val1: int, start_val2: int) -> None:
             ), f"{num=} not equal to either start values: {start_val1}, {start_val2}"
 
 
-def fixed_producer(queue: MessageQueue, messages: list[int]) -> None:
-    for message in messages:
-        queue.add_item(message)
+def fixed_producer(
+    queue: MessageQueue,
+    termination_controller: TerminationController,
+    messages: list[int],
+) -> None:
+    for start in range(0, len(messages), PRODUCER_BATCH_SIZE):
+        batch = messages[start : start + PRODUCER_BATCH_SIZE]
+        if not add_items_until_accepted(queue, termination_controller, batch):
+            return
 
 
 def stress_test(
@@ -199,11 +328,27 @@ def stress_test(
     message_queue = MessageQueue(use_locks=True)
     termination_controller = TerminationController(test_time_seconds)
     result: list[int] = []
-    with ThreadPoolExecutor() as executor:
-        executor.submit(fixed_producer, message_queue, messages1)
-        executor.submit(fixed_producer, message_queue, messages2)
-        executor.submit(consumer, message_queue, termination_controller, result, 0)
-        executor.submit(consumer, message_queue, termination_controller, result, 0)
+    threads = [
+        threading.Thread(
+            target=fixed_producer,
+            args=(message_queue, termination_controller, messages1),
+        ),
+        threading.Thread(
+            target=fixed_producer,
+            args=(message_queue, termination_controller, messages2),
+        ),
+        # one consumer checks and pops separately, so it can race with the fast consumer
+        threading.Thread(
+            target=consumer, args=(message_queue, termination_controller, result, 0)
+        ),
+        threading.Thread(
+            target=fast_consumer, args=(message_queue, termination_controller, result)
+        ),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
     return result
 
 
@@ -227,8 +372,14 @@ def test_race_conditions_stress(start_val1: int, start_val2: int) -> None:
 if __name__ == "__main__":
     # set to logging.WARNING for stress testing, to speed up the consumers
     # by removing the logging time
-    log = logging.getLogger(name="threading_test")
     logging.basicConfig(level=logging.WARNING)
 
+    # sys._is_gil_enabled only exists from Python 3.13, before that the GIL is always enabled
+    if getattr(sys, "_is_gil_enabled", lambda: True)():
+        log.warning(
+            "The GIL is enabled, so the producers and consumers can't run in parallel, "
+            "use a free-threaded build of Python (3.13t or later) to stress test with real parallelism"
+        )
+
     run_experiment()
     stress_test(list(range(1, 1_000_000)), list(range(1_000_000, 2_000_000)))
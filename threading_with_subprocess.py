@@ -13,14 +13,14 @@ def run_cpp_sleep() -> None:
 
 
 def main() -> None:
-    start_time = time.time()
+    start_time = time.monotonic()
     thread1 = Thread(target=run_cpp_sleep)
     thread2 = Thread(target=run_cpp_sleep)
     thread1.start()
     thread2.start()
     thread1.join()
     thread2.join()
-    print(f"Time taken={time.time() - start_time}")
+    print(f"Time taken={time.monotonic() - start_time}")
 
 
 if __name__ == "__main__":